@@ -1,58 +1,144 @@
-import os
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import urllib3
+from bs4 import BeautifulSoup, SoupStrainer
 from urllib.parse import urljoin
-import urllib.request
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
 import zipfile
 import shutil
+import io
+import time
 
-def download_images(url, output_folder):
-    response = requests.get(url)
-    soup = BeautifulSoup(response.text, 'html.parser')
-    img_tags = soup.find_all('img')
-    
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+MAX_WORKERS = 10
+URL_WORKERS = 4
+CHUNK_SIZE = 256 * 1024
+ZIP_BUFFER_SIZE = 1 << 20
+# (connect, read) timeouts in seconds, so a stalled socket raises instead of hanging
+TIMEOUT = (10, 30)
+
+# Retry failed connects, header timeouts and 429/5xx responses with a short exponential backoff,
+# honouring Retry-After on 429/503. urllib3 stops retrying once the headers arrive, so failures
+# while reading an image body are retried separately in download_image().
+RETRY = Retry(total=3, backoff_factor=0.2, status_forcelist=(429, 500, 502, 503, 504))
+
+# One lock per cbz filename, so pages that share a title don't write the same file at once,
+# and the web.txt index of the page that last wrote each one
+CBZ_LOCKS = {}
+CBZ_WRITTEN = {}
+CBZ_LOCKS_LOCK = threading.Lock()
+
+# Share one session so keep-alive connections are reused across pages and images
+SESSION = requests.Session()
+adapter = HTTPAdapter(pool_connections=MAX_WORKERS, pool_maxsize=URL_WORKERS * MAX_WORKERS, max_retries=RETRY)
+SESSION.mount('http://', adapter)
+SESSION.mount('https://', adapter)
+
+def extract_image_urls(url):
+    response = SESSION.get(url, timeout=TIMEOUT)
+    # Only <title> and <img> are used, so let lxml skip building the rest of the tree
+    soup = BeautifulSoup(response.content, 'lxml', parse_only=SoupStrainer(['title', 'img']))
+    title = soup.title.string.strip()
     
-    for idx, img_tag in enumerate(img_tags):
-        img_url = img_tag.get('src')
+    # Skip duplicate images (e.g. repeated banners) so each one is only downloaded once
+    seen = set()
+    img_urls = []
+    for img_tag in soup.find_all('img'):
+        src = img_tag.get('src')
+        if not src:
+            continue
         
         # Convert relative URL to absolute URL
-        img_url = urljoin(url, img_url)
-        
-        img_name = f"{idx + 1:03d}.jpg"
-        img_path = os.path.join(output_folder, img_name)
-        
-        try:
-            urllib.request.urlretrieve(img_url, img_path)
-            print(f"Downloaded: {img_name}")
-        except Exception as e:
-            print(f"Error downloading {img_name}: {e}")
+        img_url = urljoin(url, src)
+        if img_url not in seen:
+            seen.add(img_url)
+            img_urls.append(img_url)
+    return img_urls, title
+
+def download_image(img_url):
+    for attempt in range(RETRY.total + 1):
+        with SESSION.get(img_url, stream=True, timeout=TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            # Let the copy run in large C-level chunks instead of a Python loop over 8 KiB pieces
+            buf = io.BytesIO()
+            try:
+                shutil.copyfileobj(response.raw, buf, CHUNK_SIZE)
+            except urllib3.exceptions.HTTPError:
+                # A stall or reset mid-body; start the image again unless we're out of attempts
+                if attempt == RETRY.total:
+                    raise
+            else:
+                # Hand back a view of the buffer rather than copying it into a new bytes object
+                return buf.getbuffer()
+        time.sleep(RETRY.backoff_factor * 2 ** attempt)
 
-def create_cbz_and_cleanup(title, folder):
+def download_to_cbz(title, img_urls):
     cbz_filename = f"{title}.cbz"
-    with zipfile.ZipFile(cbz_filename, 'w') as zipf:
-        for root, _, files in os.walk(folder):
-            for file in files:
-                file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, folder)
-                zipf.write(file_path, arcname)
+    pending = {}
+    next_idx = 0
+    # Images are already compressed, so store them as-is and batch the writes through a large buffer
+    with open(cbz_filename, 'wb', buffering=ZIP_BUFFER_SIZE) as f, \
+            zipfile.ZipFile(f, 'w', zipfile.ZIP_STORED, allowZip64=True) as zipf, \
+            ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Downloads are network-bound, so run them concurrently over the shared session
+        futures = {executor.submit(download_image, img_url): idx for idx, img_url in enumerate(img_urls)}
+        
+        for future in as_completed(futures):
+            idx = futures[future]
+            img_name = f"{idx + 1:03d}.jpg"
+            try:
+                pending[idx] = future.result()
+                print(f"[{title}] Downloaded: {img_name}")
+            except Exception as e:
+                pending[idx] = None
+                print(f"[{title}] Error downloading {img_name}: {e}")
+            
+            # Write images into the cbz in page order while the rest are still downloading
+            while next_idx in pending:
+                data = pending.pop(next_idx)
+                if data is not None:
+                    zipf.writestr(f"{next_idx + 1:03d}.jpg", data)
+                next_idx += 1
+
+def process_url(idx, url):
+    # Fetch and parse each page once, reusing it for both the title and the images
+    img_urls, title = extract_image_urls(url)
     
-    shutil.rmtree(folder)  # Delete the downloaded folder after creating the cbz
+    with CBZ_LOCKS_LOCK:
+        cbz_lock = CBZ_LOCKS.setdefault(title, threading.Lock())
+    
+    # Pages with the same title take turns on the cbz. Like a sequential run, the page listed last in web.txt
+    # must end up in it, so an earlier page is skipped once a later one has already written the file.
+    with cbz_lock:
+        if CBZ_WRITTEN.get(title, -1) > idx:
+            print(f"Skipping {url}: {title}.cbz was already written by a later line in web.txt")
+            return None
+        
+        # Images are kept in memory and written straight into the cbz, so there is no folder to clean up
+        download_to_cbz(title, img_urls)
+        CBZ_WRITTEN[title] = idx
+    return title
 
 if __name__ == "__main__":
     with open("web.txt", "r") as file:
         urls = file.read().splitlines()
     
-    for url in urls:
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title = soup.title.string.strip()
+    # Work on several pages at once so one gallery's slow tail doesn't leave the connections idle
+    with ThreadPoolExecutor(max_workers=URL_WORKERS) as executor:
+        futures = {executor.submit(process_url, idx, url): url for idx, url in enumerate(urls)}
         
-        output_folder = "downloaded_images"
-        
-        download_images(url, output_folder)
-        create_cbz_and_cleanup(title, output_folder)
-        
-        print(f"Download, cbz creation, and cleanup complete for: {title}")
-
+        try:
+            for future in as_completed(futures):
+                url = futures[future]
+                try:
+                    title = future.result()
+                    if title is not None:
+                        print(f"Download and cbz creation complete for: {title}")
+                except Exception as e:
+                    print(f"Error processing {url}: {e}")
+        except KeyboardInterrupt:
+            # Drop the pages that haven't started yet instead of working through the whole queue on Ctrl-C
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise